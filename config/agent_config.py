@@ -7,9 +7,32 @@ configurations in code.
 """
 
 import yaml
-from typing import Dict, List, Optional, Any
+from copy import deepcopy
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Any, Tuple
 import os
 
+# Prefer the libyaml-backed loader when available; it is a drop-in, much faster
+# replacement for the pure-Python SafeLoader.
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+# Parsed configurations keyed by (absolute path, mtime_ns, size), so repeated
+# AgentConfig instances share a single parse until the file changes on disk.
+_PARSE_CACHE: Dict[tuple, Dict[str, Any]] = {}
+
+# Shared AgentConfig instances keyed by absolute path, with the (mtime_ns, size)
+# of the file they were built from; see get_agent_config
+_INSTANCE_CACHE: Dict[str, Tuple[tuple, "AgentConfig"]] = {}
+
+# Model used by subagents that do not configure one explicitly
+_DEFAULT_SUBAGENT_MODEL = {
+    "model": "o4-mini",
+    "model_provider": "openai"
+}
+
 
 class AgentConfig:
     """
@@ -28,78 +51,110 @@ class AgentConfig:
         """
         self.config_path = config_path
         self.config = self._load_config()
+        self._build_indexes()
     
-    def _load_config(self) -> Dict[str, Any]:
-        """Load configuration from YAML file."""
-        if not os.path.exists(self.config_path):
-            raise FileNotFoundError(f"Configuration file not found: {self.config_path}")
+    def _build_indexes(self) -> None:
+        """Index the main agent and subagent sections for direct lookup."""
+        self._main_index = self.config.get("main_agents", {})
+        self._subagent_index = self.config.get("subagents", {})
+        # Subagent entries with the default model injected once, up front; each gets
+        # its own copy so a change through one entry cannot leak into the others
+        self._subagent_model_index = {
+            name: entry if "model" in entry else {**entry, "model": dict(_DEFAULT_SUBAGENT_MODEL)}
+            for name, entry in self._subagent_index.items()
+        }
+        # Resolved subagent lists per main agent, filled on first request so only
+        # the main agents actually used pay for copying their subagents
+        self._resolved_subagents: Dict[str, List[Dict[str, Any]]] = {}
+    
+    def _load_config(self, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Load configuration from YAML file.
         
+        Args:
+            use_cache (bool): Whether to reuse a previous parse of the same,
+                unmodified file. The fresh parse always replaces the cached one.
+        """
         try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                config = yaml.safe_load(f)
-            
-            if not config:
-                raise ValueError(f"Empty configuration file: {self.config_path}")
-            
-            return config
-        except yaml.YAMLError as e:
-            raise ValueError(f"Invalid YAML in configuration file {self.config_path}: {e}")
-        except Exception as e:
+            f = open(self.config_path, 'rb')
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Configuration file not found: {self.config_path}") from None
+        except OSError as e:
             raise RuntimeError(f"Error loading configuration from {self.config_path}: {e}")
+        
+        with f:
+            st = os.fstat(f.fileno())
+            key = (os.path.abspath(self.config_path), st.st_mtime_ns, st.st_size)
+            if use_cache and key in _PARSE_CACHE:
+                return deepcopy(_PARSE_CACHE[key])
+            
+            try:
+                # Binary mode lets libyaml detect and decode the encoding itself
+                config = yaml.load(f, Loader=_Loader)
+            except yaml.YAMLError as e:
+                raise ValueError(f"Invalid YAML in configuration file {self.config_path}: {e}")
+            except OSError as e:
+                raise RuntimeError(f"Error loading configuration from {self.config_path}: {e}")
+        
+        if not config:
+            raise ValueError(f"Empty configuration file: {self.config_path}")
+        
+        for stale in [k for k in _PARSE_CACHE if k[0] == key[0]]:
+            del _PARSE_CACHE[stale]
+        _PARSE_CACHE[key] = config
+        return deepcopy(config)
     
-    def get_main_agent(self, agent_name: str) -> Dict[str, Any]:
+    def get_main_agent(self, agent_name: str, copy: bool = False) -> Mapping[str, Any]:
         """
         Get main agent configuration.
         
         Args:
             agent_name (str): Name of the main agent (e.g., "geoflow")
+            copy (bool): Return an independent deep copy instead of a read-only view
             
         Returns:
-            Dict[str, Any]: Main agent configuration
+            Mapping[str, Any]: Main agent configuration
             
         Raises:
             KeyError: If agent not found in configuration
         """
-        if "main_agents" not in self.config:
-            raise KeyError("No 'main_agents' section found in configuration")
-        
-        if agent_name not in self.config["main_agents"]:
-            available = list(self.config["main_agents"].keys())
-            raise KeyError(f"Main agent '{agent_name}' not found. Available: {available}")
+        try:
+            entry = self._main_index[agent_name]
+        except KeyError:
+            if "main_agents" not in self.config:
+                raise KeyError("No 'main_agents' section found in configuration") from None
+            available = list(self._main_index.keys())
+            raise KeyError(f"Main agent '{agent_name}' not found. Available: {available}") from None
         
-        return self.config["main_agents"][agent_name].copy()
+        return deepcopy(entry) if copy else MappingProxyType(entry)
     
-    def get_subagent(self, subagent_name: str, include_model: bool = True) -> Dict[str, Any]:
+    def get_subagent(
+        self, subagent_name: str, include_model: bool = True, copy: bool = False
+    ) -> Mapping[str, Any]:
         """
         Get subagent configuration.
         
         Args:
             subagent_name (str): Name of the subagent
             include_model (bool): Whether to include default model configuration
+            copy (bool): Return an independent deep copy instead of a read-only view
             
         Returns:
-            Dict[str, Any]: Subagent configuration with model defaults
+            Mapping[str, Any]: Subagent configuration with model defaults
             
         Raises:
             KeyError: If subagent not found in configuration
         """
-        if "subagents" not in self.config:
-            raise KeyError("No 'subagents' section found in configuration")
-        
-        if subagent_name not in self.config["subagents"]:
-            available = list(self.config["subagents"].keys())
-            raise KeyError(f"Subagent '{subagent_name}' not found. Available: {available}")
-        
-        subagent = self.config["subagents"][subagent_name].copy()
-        
-        # Add default model configuration if requested and not already present
-        if include_model and "model" not in subagent:
-            subagent["model"] = {
-                "model": "o4-mini",
-                "model_provider": "openai"
-            }
+        index = self._subagent_model_index if include_model else self._subagent_index
+        try:
+            subagent = index[subagent_name]
+        except KeyError:
+            if "subagents" not in self.config:
+                raise KeyError("No 'subagents' section found in configuration") from None
+            available = list(self._subagent_index.keys())
+            raise KeyError(f"Subagent '{subagent_name}' not found. Available: {available}") from None
         
-        return subagent
+        return deepcopy(subagent) if copy else MappingProxyType(subagent)
     
     def get_subagents_for_main(self, agent_name: str) -> List[Dict[str, Any]]:
         """
@@ -109,12 +164,21 @@ class AgentConfig:
             agent_name (str): Name of the main agent
             
         Returns:
-            List[Dict[str, Any]]: List of subagent configurations
+            List[Dict[str, Any]]: List of subagent configurations, as plain dicts
+                suitable for ``create_deep_agent(subagents=...)``. The list is
+                resolved on first request per load and shared between calls.
         """
-        main_agent = self.get_main_agent(agent_name)
-        subagent_names = main_agent.get("subagents", [])
+        try:
+            return self._resolved_subagents[agent_name]
+        except KeyError:
+            pass
+        
+        subagent_names = self.get_main_agent(agent_name).get("subagents", [])
         
-        return [self.get_subagent(name) for name in subagent_names]
+        # Not memoized until every subagent resolves, so unknown names keep raising
+        resolved = [self.get_subagent(name, copy=True) for name in subagent_names]
+        self._resolved_subagents[agent_name] = resolved
+        return resolved
     
     def list_main_agents(self) -> List[str]:
         """
@@ -123,7 +187,7 @@ class AgentConfig:
         Returns:
             List[str]: List of main agent names
         """
-        return list(self.config.get("main_agents", {}).keys())
+        return list(self._main_index.keys())
     
     def list_subagents(self) -> List[str]:
         """
@@ -132,12 +196,43 @@ class AgentConfig:
         Returns:
             List[str]: List of subagent names
         """
-        return list(self.config.get("subagents", {}).keys())
+        return list(self._subagent_index.keys())
     
     def reload_config(self) -> None:
-        """Reload configuration from file."""
-        self.config = self._load_config()
+        """Reload configuration from file, bypassing the parse cache."""
+        self.config = self._load_config(use_cache=False)
+        self._build_indexes()
+
+
+def get_agent_config(config_path: str = "config/agents.yaml") -> AgentConfig:
+    """
+    Get the shared AgentConfig for a configuration file.
+    
+    Every caller asking for the same file gets the same instance, so entrypoints
+    and request handlers do not each rebuild one. The instance is replaced when
+    the file changes on disk (e.g. after improve_prompt rewrites it).
+    
+    Args:
+        config_path (str): Path to the YAML configuration file
+        
+    Returns:
+        AgentConfig: The shared configuration loader for that file
+    """
+    path = os.path.abspath(config_path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        # Let AgentConfig raise its usual error for a missing or unreadable file
+        return AgentConfig(config_path)
+    version = (st.st_mtime_ns, st.st_size)
+    
+    cached = _INSTANCE_CACHE.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    config = AgentConfig(config_path)
+    _INSTANCE_CACHE[path] = (version, config)
+    return config
 
 
 # Default instance for easy importing
-default_config = AgentConfig()
\ No newline at end of file
+default_config = get_agent_config()
\ No newline at end of file
@@ -9,71 +9,115 @@ ARCHITECTURE OVERVIEW:
 - Standard deepagents state management
 """
 
+import functools
+from copy import deepcopy
+import io
 import os
-from typing import List, Dict, Literal
-import chromadb
+import tempfile
+import threading
+from typing import Literal, Optional, Tuple, get_args
 from dotenv import load_dotenv
 
 from deepagents import create_deep_agent
-from config.agent_config import AgentConfig
-
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_core.documents import Document
-from langchain_chroma import Chroma
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
+from config.agent_config import AgentConfig, get_agent_config
+from geoflow_retrieval import vector_search, vector_search_batch
 
 from ruamel.yaml import YAML
-import shutil
-from datetime import datetime
 # from tavily import TavilyClient
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    import json
+
 # Load environment variables
 load_dotenv()
 
-embeddings = GoogleGenerativeAIEmbeddings(
-    model="models/embedding-001",
-    google_api_key=os.getenv("GOOGLE_API_KEY")
-)
 
-# Load all documents from ChromaDB for both retrievers
-client = chromadb.PersistentClient(path="./chroma_db")
-collection = client.get_collection("semantic_chunks_gradient_05")
+# ruamel YAML instances keep their scanner/parser state on the instance, and the sync
+# tools run concurrently in executor threads, so each call builds its own handlers.
+def _make_rt_yaml() -> YAML:
+    """Round-trip handler for edits that must preserve YAML formatting (multi-line string literals, quotes)."""
+    rt_yaml = YAML()
+    rt_yaml.preserve_quotes = True
+    rt_yaml.width = 4096  # Prevent line wrapping
+    rt_yaml.map_indent = 2
+    rt_yaml.sequence_indent = 4
+    return rt_yaml
+
 
-print("Loading documents for hybrid search...")
-all_results = collection.get(include=['documents', 'metadatas'])
-documents = []
+def _make_safe_yaml() -> YAML:
+    """libyaml-backed safe handler for plain reads."""
+    return YAML(typ="safe", pure=False)
 
-for i, doc in enumerate(all_results['documents']):
-    metadata = all_results['metadatas'][i] if all_results['metadatas'] else {}
-    documents.append(Document(
-        page_content=doc,
-        metadata=metadata or {}
-    ))
+# agents.yaml stays authoritative; agents.json is a machine-read mirror written by
+# improve_prompt. It records the (mtime_ns, size) of the YAML it was generated from
+# and is only trusted while that matches the YAML exactly, so restoring an older
+# file (e.g. renaming agents.yaml.bak back, which keeps its mtime) falls back to YAML.
+CONFIG_FILE = "config/agents.yaml"
+CONFIG_MIRROR_FILE = "config/agents.json"
+# (YAML version, parsed config), replaced as one tuple so a concurrent reader never
+# pairs a new version with an old config; callers get copies, never the cached dict
+_read_config_cache: Optional[Tuple[list, dict]] = None
 
-# Create vector store retriever
-vectorstore = Chroma.from_documents(documents, embeddings)
-vectorstore_retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
 
-# Create keyword retriever
-keyword_retriever = BM25Retriever.from_documents(documents)
-keyword_retriever.k = 5
+def _yaml_version() -> list:
+    """Return the (mtime_ns, size) of the YAML config, as recorded in the mirror."""
+    st = os.stat(CONFIG_FILE)
+    return [st.st_mtime_ns, st.st_size]
 
-# Create ensemble (hybrid) retriever
-ensemble_retriever = EnsembleRetriever(
-    retrievers=[vectorstore_retriever, keyword_retriever],
-    weights=[0.7, 0.3]  # 70% semantic, 30% keyword
-)
 
-print(f"Loaded {len(documents)} documents for hybrid search")
+def _write_config_mirror(config: dict) -> None:
+    """Write the JSON mirror of the agent config; failures leave read_config on YAML."""
+    tmp_path = CONFIG_MIRROR_FILE + ".tmp"
+    try:
+        mirror = {"source": _yaml_version(), "config": config}
+        if orjson is not None:
+            with open(tmp_path, "wb") as file:
+                file.write(orjson.dumps(mirror, option=orjson.OPT_INDENT_2))
+        else:
+            with open(tmp_path, "w", encoding='utf-8') as file:
+                json.dump(mirror, file, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, CONFIG_MIRROR_FILE)
+    except (OSError, TypeError, ValueError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 
 def read_config():
     """Tool to read the config of all the agents"""
-    yaml_handler = YAML()
-    with open("config/agents.yaml", "r") as file:
-        return yaml_handler.load(file)
+    global _read_config_cache
+    key = _yaml_version()
+    cached = _read_config_cache
+    if cached is not None and cached[0] == key:
+        return deepcopy(cached[1])
+    
+    config = None
+    try:
+        with open(CONFIG_MIRROR_FILE, "rb") as file:
+            mirror = orjson.loads(file.read()) if orjson is not None else json.load(file)
+        if isinstance(mirror, dict) and mirror.get("source") == key:
+            config = mirror["config"]
+    except (OSError, ValueError, KeyError):
+        pass
+    if config is None:
+        with open(CONFIG_FILE, "r") as file:
+            config = _make_safe_yaml().load(file)
+    
+    _read_config_cache = (key, config)
+    return deepcopy(config)
+
+
+# Serializes improve_prompt's read-modify-write, so concurrent edits (to different
+# agents, say) do not overwrite each other's changes
+_config_write_lock = threading.Lock()
 
-def improve_prompt(agent_name: Literal['geoflow', 'regulatory-expert', 'risk-resolver', 'compliance-critic'], is_main_agent: bool, new_prompt: str):
+AgentName = Literal['geoflow', 'regulatory-expert', 'risk-resolver', 'compliance-critic']
+_VALID_AGENT_NAMES = frozenset(get_args(AgentName))
+
+
+def improve_prompt(agent_name: AgentName, is_main_agent: bool, new_prompt: str):
     """
     Update the system prompt or instructions for a specified agent in the configuration file.
     Uses ruamel.yaml to preserve YAML formatting including multi-line string literals.
@@ -86,97 +130,71 @@ def improve_prompt(agent_name: Literal['geoflow', 'regulatory-expert', 'risk-res
     Returns:
         str: A message indicating whether the prompt was successfully updated.
     """
-    config_file = "config/agents.yaml"
-    
-    # Create backup with timestamp
-    backup_path = f"config/agents.yaml.backup.{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-    try:
-        shutil.copy2(config_file, backup_path)
-    except Exception as e:
-        return f"Error creating backup: {e}"
+    # Reject unknown (e.g. hallucinated) agent names before touching the config file
+    if agent_name not in _VALID_AGENT_NAMES:
+        return f"Error: unknown agent {agent_name}. Must be one of {sorted(_VALID_AGENT_NAMES)}"
     
-    # Initialize ruamel.yaml with formatting preservation
-    yaml_handler = YAML()
-    yaml_handler.preserve_quotes = True
-    yaml_handler.width = 4096  # Prevent line wrapping
-    yaml_handler.map_indent = 2
-    yaml_handler.sequence_indent = 4
+    config_file = CONFIG_FILE
+    backup_path = config_file + ".bak"
+    tmp_path = None
     
     try:
-        # Load current configuration
-        with open(config_file, "r", encoding='utf-8') as file:
-            config = yaml_handler.load(file)
-        
-        # Update the appropriate field
-        if is_main_agent:
-            if 'main_agents' not in config or 'geoflow' not in config['main_agents']:
-                return f"Error: main_agents.geoflow not found in config"
-            config['main_agents']['geoflow']['instructions'] = new_prompt
-        else:
-            if 'subagents' not in config or agent_name not in config['subagents']:
-                return f"Error: subagents.{agent_name} not found in config"
-            config['subagents'][agent_name]['prompt'] = new_prompt
-        
-        # Write back with preserved formatting
-        with open(config_file, "w", encoding='utf-8') as file:
-            yaml_handler.dump(config, file)
-        
-        # Validate the written file
-        with open(config_file, "r", encoding='utf-8') as file:
-            yaml_handler.load(file)  # Will raise exception if invalid
+        with _config_write_lock:
+            rt_yaml = _make_rt_yaml()
+            
+            # Load current configuration
+            with open(config_file, "r", encoding='utf-8') as file:
+                config = rt_yaml.load(file)
+            
+            # Update the appropriate field
+            if is_main_agent:
+                if 'main_agents' not in config or 'geoflow' not in config['main_agents']:
+                    return f"Error: main_agents.geoflow not found in config"
+                config['main_agents']['geoflow']['instructions'] = new_prompt
+            else:
+                if 'subagents' not in config or agent_name not in config['subagents']:
+                    return f"Error: subagents.{agent_name} not found in config"
+                config['subagents'][agent_name]['prompt'] = new_prompt
+            
+            # Serialize with preserved formatting and validate in memory before touching disk
+            buffer = io.StringIO()
+            rt_yaml.dump(config, buffer)
+            serialized = buffer.getvalue()
+            validated = _make_safe_yaml().load(serialized)  # Will raise exception if invalid
+            
+            # Write to a temp file of this call's own, next to the config so the final rename
+            # stays on one filesystem, and flush it to disk before it replaces anything
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(config_file) or ".", prefix=".agents.", suffix=".yaml.tmp"
+            )
+            with os.fdopen(fd, "w", encoding='utf-8') as file:
+                file.write(serialized)
+                file.flush()
+                os.fsync(file.fileno())
+            os.chmod(tmp_path, os.stat(config_file).st_mode & 0o777)
+            
+            # Keep the previous version as a single rolling backup by hard-linking it, so
+            # agents.yaml never goes missing, then swap the new version in with one rename
+            try:
+                os.remove(backup_path)
+            except FileNotFoundError:
+                pass
+            os.link(config_file, backup_path)
+            os.replace(tmp_path, config_file)
+            tmp_path = None
+            _write_config_mirror(validated)
             
         return f"Prompt successfully updated for {agent_name}. Backup created: {backup_path}"
         
     except Exception as e:
-        # Restore from backup if something went wrong
+        # agents.yaml is only ever replaced by the final rename, so it is intact here;
+        # clean up this call's temp file and nothing else
         try:
-            shutil.copy2(backup_path, config_file)
-            return f"Error updating prompt: {e}. Configuration restored from backup."
-        except Exception as restore_error:
-            return f"Critical error: Failed to update prompt ({e}) and failed to restore backup ({restore_error})"
-
-
-def vector_search(query: str, n_results: int = 10) -> List[Dict]:
-    """
-    Minimal search function for ChromaDB collection.
-    Args:
-        query (str): The search query.
-        n_results (int, optional): The number of results to return. Defaults to 5.
-    Returns:
-        List[Dict]: A list of search results, each containing:
-            - content (str): The content of the chunk.
-            - distance (float): The distance score of the chunk.
-            - source (str): The source file of the chunk.
-            - json_file (str): The JSON file associated with the chunk.
-    """
-    search_type = "hybrid"  # Change this to "semantic", "keyword", or "hybrid"
-    # Set the number of results for all retrievers
-    vectorstore_retriever.search_kwargs["k"] = n_results
-    keyword_retriever.k = n_results
-    
-    # Choose retriever based on search type
-    if search_type == "semantic":
-        retriever = vectorstore_retriever
-    elif search_type == "keyword":
-        retriever = keyword_retriever
-    else:  # hybrid
-        retriever = ensemble_retriever
-    
-    # Get results
-    results = retriever.get_relevant_documents(query)
-    
-    # Format results
-    search_results = []
-    for i, doc in enumerate(results[:n_results]):
-        search_results.append({
-            'content': doc.page_content,
-            'source': doc.metadata.get('source_file', 'Unknown'),
-            'json_file': doc.metadata.get('json_file', 'Unknown'),
-            'search_type': search_type,
-            'rank': i + 1
-        })
-    
-    return search_results
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return f"Error updating prompt: {e}. Configuration left unchanged."
+        except Exception as cleanup_error:
+            return f"Error updating prompt: {e}. Configuration left unchanged, but failed to remove {tmp_path} ({cleanup_error})"
 
 
 # tavily_client = TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
@@ -198,14 +216,31 @@ def vector_search(query: str, n_results: int = 10) -> List[Dict]:
 #     return search_docs
 
 
-# Load agent configuration
-config = AgentConfig()
-geoflow_config = config.get_main_agent("geoflow")
-subagents = config.get_subagents_for_main("geoflow")
+# Compiled agents per (configuration, main agent). get_agent_config hands out a new
+# AgentConfig once agents.yaml changes on disk, so a prompt edit yields a fresh agent
+# while callers asking for an unchanged configuration share the compiled graph
+@functools.lru_cache(maxsize=4)
+def _build_agent(config: AgentConfig, agent_name: str):
+    # Load agent configuration
+    main_config = config.get_main_agent(agent_name)
+    subagents = config.get_subagents_for_main(agent_name)
+
+    return create_deep_agent(
+        tools=[vector_search, vector_search_batch, read_config, improve_prompt],
+        instructions=main_config["instructions"],
+        subagents=subagents,
+    ).with_config({"recursion_limit": main_config["recursion_limit"]})
+
+
+def create_geoflow_agent(agent_name: str = "geoflow"):
+    """
+    Get the compiled agent for a main agent in the current configuration.
+
+    Repeat calls (e.g. one per server request) reuse the agent built for the
+    same, unmodified agents.yaml instead of rebuilding the agent graph.
+    """
+    return _build_agent(get_agent_config(), agent_name)
+
 
 # Create the GeoFlow CDS main agent
-geoflow_agent = create_deep_agent(
-    tools=[vector_search, read_config, improve_prompt],
-    instructions=geoflow_config["instructions"],
-    subagents=subagents,
-).with_config({"recursion_limit": geoflow_config["recursion_limit"]})
\ No newline at end of file
+geoflow_agent = create_geoflow_agent()
\ No newline at end of file
@@ -0,0 +1,763 @@
+# GeoFlow Compliance Detection System - Hybrid Retrieval
+"""
+Hybrid (semantic + keyword) retrieval over the indexed regulations.
+
+Shared by every GeoFlow entrypoint; Python's module cache means the
+retrievers below are built at most once per process.
+
+COMPONENTS:
+- Semantic search over the persistent ChromaDB collection, with Google or local (BGE) query embeddings
+- BM25 keyword search (bm25s sparse index), cached on disk per corpus version and memory-mapped on load
+- Weighted reciprocal rank fusion of both rankings
+- Cross-encoder (FlashRank) reranking of the fused candidates
+- Exact and near-duplicate query result caching
+- Async search: the semantic and keyword branches run concurrently, and concurrent
+  vector_search calls are micro-batched into shared embedding and ChromaDB calls
+- Batched multi-query search: one embedding request and one ChromaDB query for all queries
+"""
+
+import asyncio
+import os
+import functools
+import hashlib
+import pickle
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List, Dict, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+import bm25s
+from bm25s.stopwords import STOPWORDS_EN
+from bm25s.tokenization import Tokenizer
+
+from langchain_core.embeddings import Embeddings
+
+# chromadb, flashrank and the Google/LangChain embedding stack take over a second
+# to import, so they are imported inside the factories that first need them
+if TYPE_CHECKING:
+    import chromadb
+    from flashrank import Ranker
+
+# Load environment variables
+load_dotenv()
+
+# Persistent ChromaDB collection holding the embedded regulation chunks
+CHROMA_PATH = "./chroma_db"
+COLLECTION_NAME = "semantic_chunks_gradient_05"
+# HNSW parameters: 16 links per node; a wide build beam (ef_construction), paid once
+# per rebuild, for a better-connected graph; and a query beam (ef_search) below
+# Chroma's default of 100, which is ample at this corpus size. ef_search is applied in
+# place when the collection is opened; the build-time parameters need rebuild_collection
+HNSW_CONFIG = {"space": "cosine", "max_neighbors": 16, "ef_construction": 200, "ef_search": 50}
+# Documents fetched per collection.get call when building the keyword index
+CORPUS_PAGE_SIZE = 2048
+# Records per collection.add call in rebuild_collection; mid-sized batches insert
+# much faster than one large call, and stay under the client's hard batch limit
+INSERT_BATCH_SIZE = 200
+
+
+EMBEDDING_MODEL = "models/embedding-001"
+# EMBEDDING_BACKEND=local embeds queries on the CPU with a small BGE model instead,
+# taking the Google round-trip off every search. Its vectors are not comparable with
+# Google's, so it searches a copy of the collection re-embedded by build_local_collection
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google").lower()
+LOCAL_EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+LOCAL_QUERY_INSTRUCTION = "Represent this sentence for searching relevant passages: "
+LOCAL_COLLECTION_NAME = f"{COLLECTION_NAME}_bge_small"
+SEARCH_COLLECTION_NAME = LOCAL_COLLECTION_NAME if EMBEDDING_BACKEND == "local" else COLLECTION_NAME
+# Query embeddings are persisted here so repeated queries skip the Google round-trip across runs
+EMBEDDING_CACHE_DIR = os.path.join(".cache", "embeddings")
+# Recent query embeddings are also kept in memory, sparing the disk read and decode
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+_query_embedding_cache: "OrderedDict[str, Tuple[float, ...]]" = OrderedDict()
+
+
+def _build_once(factory):
+    """
+    Cache a zero-argument factory's result, building it at most once per process.
+
+    Searches first run on worker threads (via asyncio.to_thread), and
+    functools.cache alone lets concurrent first calls each run the factory, so
+    the first call builds under a lock while later callers wait for its result.
+    """
+    lock = threading.Lock()
+    cached = functools.lru_cache(maxsize=1)(factory)
+
+    @functools.wraps(factory)
+    def wrapper():
+        with lock:
+            return cached()
+
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
+
+
+@_build_once
+def get_local_embeddings() -> Embeddings:
+    """Load the local BGE embedding model (downloaded from Hugging Face) on first use."""
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(
+        model_name=LOCAL_EMBEDDING_MODEL,
+        encode_kwargs={"normalize_embeddings": True},
+    )
+
+
+@_build_once
+def get_embeddings() -> Embeddings:
+    """Create the query embedding model, backed by an on-disk embedding cache, on first use."""
+    from langchain.embeddings import CacheBackedEmbeddings
+    from langchain.storage import LocalFileStore
+
+    if EMBEDDING_BACKEND == "local":
+        model = LOCAL_EMBEDDING_MODEL
+        underlying = get_local_embeddings()
+    else:
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        model = EMBEDDING_MODEL
+        underlying = GoogleGenerativeAIEmbeddings(
+            model=EMBEDDING_MODEL,
+            google_api_key=os.getenv("GOOGLE_API_KEY")
+        )
+    return CacheBackedEmbeddings.from_bytes_store(
+        underlying,
+        LocalFileStore(EMBEDDING_CACHE_DIR),
+        namespace=model.rsplit("/", 1)[-1],
+        query_embedding_cache=True,
+        key_encoder="sha256",
+    )
+
+
+# Hybrid search fuses semantic and keyword rankings with weighted reciprocal rank fusion
+HYBRID_WEIGHTS = (0.7, 0.3)  # 70% semantic, 30% keyword
+RRF_C = 60
+SEARCH_TYPE = "hybrid"  # Change this to "semantic", "keyword", or "hybrid"
+
+# The top fused candidates are rescored by a CPU cross-encoder and only the best
+# n_results are returned, so the agents read fewer, more relevant chunks
+RERANK_MODEL = "ms-marco-MiniLM-L-12-v2"
+RERANK_MODEL_DIR = os.path.join(".cache", "flashrank")
+RERANK_CANDIDATES = 30
+# Cross-encoder scores per (normalized query, chunk), expiring like cached results
+RERANK_CACHE_SIZE = 16384
+_rerank_cache: "OrderedDict[Tuple[str, str], Tuple[float, float]]" = OrderedDict()
+
+# Results are built and cached as immutable rows of RESULT_FIELDS; each tool call
+# turns them into fresh dicts, so callers cannot mutate the caches. score is the
+# cross-encoder relevance score the rank is ordered by (higher is more relevant)
+RESULT_FIELDS = ('content', 'source', 'json_file', 'score', 'rank')
+ResultRow = Tuple[str, str, str, float, int]
+
+# Repeats of a (normalized query, n_results) pair are answered from a bounded LRU of
+# results; entries expire after RESULT_CACHE_TTL seconds
+RESULT_CACHE_SIZE = 4096
+RESULT_CACHE_TTL = 900
+_result_cache: "OrderedDict[Tuple[str, int], Tuple[float, Tuple[ResultRow, ...]]]" = OrderedDict()
+
+# Queries whose embedding is this close (cosine) to a recent query reuse its results;
+# entries are (query vector, n_results, results, expiry) and expire like cached results
+SEMANTIC_CACHE_SIZE = 256
+SEMANTIC_CACHE_THRESHOLD = 0.95
+_semantic_cache: deque = deque(maxlen=SEMANTIC_CACHE_SIZE)
+
+# Concurrent vector_search calls (e.g. from parallel sub-agents) arriving within this
+# window are searched together, up to MICRO_BATCH_SIZE queries per batch
+MICRO_BATCH_WINDOW = 0.075
+MICRO_BATCH_SIZE = 16
+
+
+@_build_once
+def get_reranker() -> "Ranker":
+    """Load the cross-encoder reranker (downloaded to RERANK_MODEL_DIR) on first use."""
+    from flashrank import Ranker
+
+    return Ranker(model_name=RERANK_MODEL, cache_dir=RERANK_MODEL_DIR)
+
+
+# Cached keyword indexes live under a directory per layout, bumped whenever the
+# pickled chunks or the index change shape, so stale caches are never loaded
+KEYWORD_INDEX_FORMAT = "v2"
+
+# BM25 tokenization, shared by the index Tokenizer and query tokenization: lowercased
+# words of two or more characters, English stopwords removed
+_TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+_STOPWORDS = frozenset(STOPWORDS_EN)
+
+
+@functools.lru_cache(maxsize=RESULT_CACHE_SIZE)
+def _tokenize_query(text: str) -> Tuple[str, ...]:
+    """Tokenize one query; agents reuse query formulations, so tokens are memoized."""
+    # A precompiled regex and a frozenset lookup, rather than bm25s.tokenize, which
+    # rebuilds its stopword list and vocabulary on every call
+    return tuple(token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in _STOPWORDS)
+
+
+def _tokenize(texts: List[str]) -> List[List[str]]:
+    """Tokenize query texts for BM25 with the same rules the index was built with."""
+    return [list(_tokenize_query(text)) for text in texts]
+
+
+@dataclass(frozen=True, slots=True)
+class Chunk:
+    """
+    One indexed chunk, as ranking and formatting read it.
+
+    Held as a slotted record rather than a Document with a per-chunk metadata
+    dict; the corpus is built once and retrieval passes around positions in it.
+    """
+
+    content: str
+    source_file: str
+    json_file: str
+
+
+def _to_chunks(contents: List[str], metadatas: List[Optional[Dict]]) -> List[Chunk]:
+    """Reduce ChromaDB's parallel document/metadata arrays to Chunks."""
+    return [
+        Chunk(content, (metadata or {}).get('source_file', 'Unknown'), (metadata or {}).get('json_file', 'Unknown'))
+        for content, metadata in zip(contents, metadatas)
+    ]
+
+
+def _load_keyword_index(collection) -> Tuple[bm25s.BM25, List[Chunk]]:
+    """Load the BM25 index for the collection from the disk cache, fitting it on a miss."""
+    # The BM25 index is cached on disk per corpus version, keyed by the collection's document IDs
+    corpus_ids = sorted(collection.get(include=[])['ids'])
+    corpus_hash = hashlib.sha256("\n".join(corpus_ids).encode("utf-8")).hexdigest()[:16]
+    retriever_cache_dir = os.path.join(".cache", "retrievers", KEYWORD_INDEX_FORMAT, corpus_hash)
+    bm25_index_dir = os.path.join(retriever_cache_dir, "bm25s")
+    # Written after the index, so its presence marks a complete cache entry
+    chunks_cache_path = os.path.join(retriever_cache_dir, "chunks.pkl")
+
+    if os.path.exists(chunks_cache_path):
+        print(f"Loading cached keyword index from {retriever_cache_dir}...")
+        # The score matrix is memory-mapped rather than read, so start-up does no
+        # index work and processes sharing the cache share its pages
+        bm25 = bm25s.BM25.load(bm25_index_dir, mmap=True, show_progress=False)
+        with open(chunks_cache_path, "rb") as f:
+            return bm25, pickle.load(f)
+
+    # Page documents out of ChromaDB for the keyword index, tokenizing each page as it
+    # arrives so the raw page can be released before the next one is fetched. Pages
+    # share one vocabulary, so the corpus is held as integer token IDs rather than
+    # per-document lists of token strings
+    print("Loading documents for hybrid search...")
+    chunks: List[Chunk] = []
+    tokenizer = Tokenizer(splitter=_TOKEN_PATTERN.findall, stopwords=list(_STOPWORDS))
+    corpus_token_ids: List[List[int]] = []
+    offset = 0
+    while True:
+        page = collection.get(
+            include=['documents', 'metadatas'], limit=CORPUS_PAGE_SIZE, offset=offset
+        )
+        docs_raw = page['documents']
+        metas = page.get('metadatas') or [{}] * len(docs_raw)
+        chunks.extend(_to_chunks(docs_raw, metas))
+        corpus_token_ids.extend(
+            tokenizer.tokenize(docs_raw, update_vocab=True, return_as="ids", show_progress=False)
+        )
+        offset += len(docs_raw)
+        del page
+        if len(docs_raw) < CORPUS_PAGE_SIZE:
+            break
+
+    # bm25s precomputes every term's BM25 contribution into a sparse matrix, so a
+    # query is a handful of sparse column lookups instead of a full-corpus rescore
+    bm25 = bm25s.BM25()
+    bm25.index((corpus_token_ids, tokenizer.get_vocab_dict()), show_progress=False)
+    del corpus_token_ids
+    bm25.save(bm25_index_dir, show_progress=False)
+    with open(chunks_cache_path, "wb") as f:
+        pickle.dump(chunks, f)
+    return bm25, chunks
+
+
+@_build_once
+def get_retrievers() -> Tuple["chromadb.Collection", bm25s.BM25, List[Chunk], Dict[str, int]]:
+    """
+    Build the semantic and keyword retrievers on first use.
+
+    Returns the ChromaDB collection, the BM25 index, the chunks its scores
+    are indexed against, and each distinct chunk content's position in those
+    chunks (the first, for duplicated chunks).
+
+    Deferred until the first vector_search call so that importing an entrypoint
+    (e.g. geoflow_agent for read_config or improve_prompt) does not open ChromaDB
+    or load BM25.
+    """
+    import chromadb
+
+    # Open the persistent ChromaDB collection
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    collection = client.get_collection(SEARCH_COLLECTION_NAME)
+    hnsw = (collection.configuration or {}).get("hnsw") or {}
+    if hnsw.get("ef_search") != HNSW_CONFIG["ef_search"]:
+        collection.modify(configuration={"hnsw": {"ef_search": HNSW_CONFIG["ef_search"]}})
+
+    # The embedding client setup and the BM25 index (disk or CPU bound) are
+    # independent, so build them side by side
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        embeddings_future = executor.submit(get_embeddings)
+        keyword_future = executor.submit(_load_keyword_index, collection)
+        embeddings_future.result()
+        bm25, chunks = keyword_future.result()
+
+    # Both branches report hits as positions in chunks, so fusion can score them in
+    # one array; duplicated chunks share a position, as fusion dedupes on content
+    positions: Dict[str, int] = {}
+    for i, chunk in enumerate(chunks):
+        positions.setdefault(chunk.content, i)
+
+    print(f"Loaded {len(chunks)} documents for hybrid search")
+    return collection, bm25, chunks, positions
+
+
+def _to_positions(contents, positions: Dict[str, int]) -> np.ndarray:
+    """Map ranked chunk contents to their corpus positions, skipping unknown chunks."""
+    return np.fromiter(
+        (positions[content] for content in contents if content in positions), dtype=np.intp
+    )
+
+
+def rebuild_collection(name: str = COLLECTION_NAME) -> None:
+    """
+    Rebuild a ChromaDB collection with the HNSW parameters in HNSW_CONFIG.
+
+    The stored embeddings, documents and metadata are paged into a staging
+    collection, which then replaces the original under the same name, so
+    nothing is re-embedded and the chunk IDs (and with them the cached BM25
+    index) are unchanged. An interrupted rebuild is resumed by calling this again.
+    """
+    import chromadb
+    from chromadb.errors import NotFoundError
+
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    staging_name = f"{name}_rebuild"
+    existing = {collection.name for collection in client.list_collections()}
+    if name not in existing and staging_name in existing:
+        # Interrupted between dropping the original and renaming the copy
+        client.get_collection(staging_name).modify(name=name)
+        return
+
+    source = client.get_collection(name)
+    try:
+        client.delete_collection(staging_name)
+    except NotFoundError:
+        pass
+    # HNSW settings now live in the configuration, so drop legacy hnsw:* metadata keys
+    metadata = {k: v for k, v in (source.metadata or {}).items() if not k.startswith("hnsw:")}
+    target = client.create_collection(
+        staging_name, configuration={"hnsw": HNSW_CONFIG}, metadata=metadata or None
+    )
+
+    batch_size = min(INSERT_BATCH_SIZE, client.get_max_batch_size())
+    offset = 0
+    while True:
+        page = source.get(
+            include=['embeddings', 'documents', 'metadatas'], limit=CORPUS_PAGE_SIZE, offset=offset
+        )
+        for start in range(0, len(page['ids']), batch_size):
+            end = start + batch_size
+            target.add(
+                ids=page['ids'][start:end],
+                embeddings=page['embeddings'][start:end],
+                documents=page['documents'][start:end],
+                metadatas=page['metadatas'][start:end],
+            )
+        offset += len(page['ids'])
+        if len(page['ids']) < CORPUS_PAGE_SIZE:
+            break
+
+    client.delete_collection(name)
+    target.modify(name=name)
+    get_retrievers.cache_clear()
+    print(f"Rebuilt {name} ({offset} chunks) with HNSW {HNSW_CONFIG}")
+
+
+def build_local_collection() -> None:
+    """
+    Re-embed COLLECTION_NAME's chunks with the local BGE model into LOCAL_COLLECTION_NAME.
+
+    Run once before searching with EMBEDDING_BACKEND=local, and again whenever
+    the source collection changes. The copy keeps the chunk IDs, so both
+    collections share one cached BM25 index.
+    """
+    import chromadb
+    from chromadb.errors import NotFoundError
+
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    source = client.get_collection(COLLECTION_NAME)
+    try:
+        client.delete_collection(LOCAL_COLLECTION_NAME)
+    except NotFoundError:
+        pass
+    target = client.create_collection(LOCAL_COLLECTION_NAME, configuration={"hnsw": HNSW_CONFIG})
+    embeddings = get_local_embeddings()
+
+    batch_size = min(INSERT_BATCH_SIZE, client.get_max_batch_size())
+    offset = 0
+    while True:
+        page = source.get(include=['documents', 'metadatas'], limit=CORPUS_PAGE_SIZE, offset=offset)
+        for start in range(0, len(page['ids']), batch_size):
+            end = start + batch_size
+            target.add(
+                ids=page['ids'][start:end],
+                embeddings=embeddings.embed_documents(page['documents'][start:end]),
+                documents=page['documents'][start:end],
+                metadatas=page['metadatas'][start:end],
+            )
+        offset += len(page['ids'])
+        if len(page['ids']) < CORPUS_PAGE_SIZE:
+            break
+
+    get_retrievers.cache_clear()
+    print(f"Built {LOCAL_COLLECTION_NAME} ({offset} chunks) with {LOCAL_EMBEDDING_MODEL}")
+
+
+def _bm25_top_n(bm25: bm25s.BM25, chunks: List[Chunk], positions: Dict[str, int], queries: List[str], n_results: int) -> List[np.ndarray]:
+    """Return the corpus positions of the top n_results chunks by BM25 score for each query, best first."""
+    n = min(n_results, len(chunks))
+    if n <= 0:
+        return [np.empty(0, dtype=np.intp) for _ in queries]
+    top, _ = bm25.retrieve(_tokenize(queries), k=n, show_progress=False)
+    return [_to_positions((chunks[i].content for i in row), positions) for row in top]
+
+
+def _semantic_top_n(collection: "chromadb.Collection", positions: Dict[str, int], query_vectors: List[List[float]], n_results: int) -> List[np.ndarray]:
+    """Return the corpus positions of the n_results nearest chunks for each query vector, best first."""
+    # The chunks were embedded with the query model, not the collection's default
+    # embedding function, so query by vector rather than by text. Metadata comes
+    # from the already loaded chunks, so only the chunk text is fetched
+    response = collection.query(
+        query_embeddings=query_vectors,
+        n_results=n_results,
+        include=['documents'],
+    )
+    return [_to_positions(docs, positions) for docs in response['documents']]
+
+
+def _reciprocal_rank_fusion(rankings: List[np.ndarray], weights, n_results: int, n_chunks: int) -> np.ndarray:
+    """Fuse ranked corpus-position arrays by weighted reciprocal rank, best first."""
+    scores = np.zeros(n_chunks, dtype=np.float64)
+    for ranking, weight in zip(rankings, weights):
+        # add.at accumulates repeated positions (duplicated chunks) instead of overwriting
+        np.add.at(scores, ranking, weight / (np.arange(1, len(ranking) + 1) + RRF_C))
+    n = min(n_results, int(np.count_nonzero(scores)))
+    if n <= 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(-scores, n - 1)[:n]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def _semantic_cache_lookup(query_vector: np.ndarray, n_results: int) -> Optional[Tuple[ResultRow, ...]]:
+    """Return unexpired cached results for a recent query with a near-identical embedding."""
+    now = time.monotonic()
+    entries = [entry for entry in list(_semantic_cache) if entry[1] == n_results and entry[3] > now]
+    if not entries:
+        return None
+    similarities = np.stack([entry[0] for entry in entries]) @ query_vector
+    best = int(np.argmax(similarities))
+    if similarities[best] >= SEMANTIC_CACHE_THRESHOLD:
+        return entries[best][2]
+    return None
+
+
+def _fuse(semantic_results: np.ndarray, keyword_results: np.ndarray, n_results: int, n_chunks: int) -> np.ndarray:
+    """Choose or fuse the branch rankings according to SEARCH_TYPE."""
+    if SEARCH_TYPE == "semantic":
+        return semantic_results[:n_results]
+    if SEARCH_TYPE == "keyword":
+        return keyword_results[:n_results]
+    return _reciprocal_rank_fusion(
+        [semantic_results, keyword_results], HYBRID_WEIGHTS, n_results, n_chunks
+    )
+
+
+def _rerank(query: str, candidates: List[Chunk], n_results: int) -> List[Tuple[Chunk, float]]:
+    """Score candidates by cross-encoder relevance to the query and keep the best n_results, with their scores."""
+    from flashrank import RerankRequest
+
+    query_key = query.lower().strip()
+    now = time.monotonic()
+    scores: Dict[int, float] = {}
+    for i, chunk in enumerate(candidates):
+        entry = _rerank_cache.get((query_key, chunk.content))
+        if entry is not None and entry[0] > now:
+            scores[i] = entry[1]
+
+    passages = [
+        {"id": i, "text": chunk.content}
+        for i, chunk in enumerate(candidates) if i not in scores
+    ]
+    if passages:
+        for passage in get_reranker().rerank(RerankRequest(query=query, passages=passages)):
+            i = passage["id"]
+            scores[i] = float(passage["score"])
+            _rerank_cache[(query_key, candidates[i].content)] = (now + RESULT_CACHE_TTL, scores[i])
+        while len(_rerank_cache) > RERANK_CACHE_SIZE:
+            _rerank_cache.popitem(last=False)
+
+    top = sorted(scores, key=scores.get, reverse=True)[:n_results]
+    return [(candidates[i], scores[i]) for i in top]
+
+
+def _format_results(results: List[Tuple[Chunk, float]], n_results: int) -> Tuple[ResultRow, ...]:
+    """Format ranked, scored chunks as result rows."""
+    return tuple(
+        (chunk.content, chunk.source_file, chunk.json_file, score, rank)
+        for rank, (chunk, score) in enumerate(results[:n_results], start=1)
+    )
+
+
+def _to_dicts(rows: Tuple[ResultRow, ...]) -> List[Dict]:
+    """Turn result rows into the tool's result dicts."""
+    return [dict(zip(RESULT_FIELDS, row)) for row in rows]
+
+
+def _rank(query: str, chunks: List[Chunk], semantic_results: np.ndarray, keyword_results: np.ndarray, n_results: int) -> Tuple[ResultRow, ...]:
+    """Fuse the branch rankings, rerank the fused candidates and format the best n_results."""
+    top = _fuse(semantic_results, keyword_results, max(n_results, RERANK_CANDIDATES), len(chunks))
+    candidates = [chunks[i] for i in top]
+    return _format_results(_rerank(query, candidates, n_results), n_results)
+
+
+def _remember_query_vector(query: str, vector) -> Tuple[float, ...]:
+    """Store a query embedding in the in-memory LRU, evicting the least recently used."""
+    vector = tuple(vector)
+    _query_embedding_cache[query] = vector
+    _query_embedding_cache.move_to_end(query)
+    if len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+        _query_embedding_cache.popitem(last=False)
+    return vector
+
+
+def _embed_query_texts(underlying: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Embed query texts in one batch, producing the vectors embed_query would."""
+    if EMBEDDING_BACKEND == "local":
+        # BGE prefixes queries, but not passages, with its retrieval instruction
+        return underlying.embed_documents([LOCAL_QUERY_INSTRUCTION + text for text in texts])
+    # Same task type embed_query uses, so batched and single vectors are interchangeable
+    return underlying.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+
+
+async def _aembed_queries(queries: List[str]) -> List[Tuple[float, ...]]:
+    """Embed queries with a single embeddings request, reusing cached query vectors."""
+    vectors: Dict[str, Tuple[float, ...]] = {}
+    for query in queries:
+        vector = _query_embedding_cache.get(query)
+        if vector is not None:
+            _query_embedding_cache.move_to_end(query)
+            vectors[query] = vector
+
+    pending = [query for query in dict.fromkeys(queries) if query not in vectors]
+    if pending:
+        # Fall back to the on-disk store, then embed whatever is still missing
+        embeddings = get_embeddings()
+        store = embeddings.query_embedding_store
+        stored = await store.amget(pending)
+        missing = [query for query, vector in zip(pending, stored) if vector is None]
+        fresh = []
+        if missing:
+            fresh = await asyncio.to_thread(_embed_query_texts, embeddings.underlying_embeddings, missing)
+            await store.amset(list(zip(missing, fresh)))
+        for query, vector in [*zip(pending, stored), *zip(missing, fresh)]:
+            if vector is not None:
+                vectors[query] = _remember_query_vector(query, vector)
+    return [vectors[query] for query in queries]
+
+
+async def _search_batch(queries: List[str], n_results: int) -> List[Tuple[ResultRow, ...]]:
+    """
+    Run the hybrid search for several queries with one embedding and one ChromaDB call.
+
+    The semantic and keyword branches run in parallel. Queries whose embedding is
+    near-identical to a recent query reuse that query's results.
+    """
+    collection, bm25, chunks, positions = await asyncio.to_thread(get_retrievers)
+    # Each branch contributes enough candidates for the reranker to choose from
+    n_candidates = max(n_results, RERANK_CANDIDATES)
+
+    # BM25 is CPU-bound and independent of the query embeddings, so start it first
+    keyword_task = None
+    if SEARCH_TYPE in ("keyword", "hybrid"):
+        keyword_task = asyncio.create_task(
+            asyncio.to_thread(_bm25_top_n, bm25, chunks, positions, queries, n_candidates)
+        )
+
+    # Embed the queries once; the vectors drive both the semantic cache and the search
+    results: List[Optional[Tuple[ResultRow, ...]]] = [None] * len(queries)
+    no_hits = np.empty(0, dtype=np.intp)
+    semantic_rankings = [no_hits] * len(queries)
+    query_vectors = None
+    if SEARCH_TYPE in ("semantic", "hybrid"):
+        query_vectors = np.asarray(await _aembed_queries(queries), dtype=np.float32)
+        norms = np.linalg.norm(query_vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        query_vectors /= norms
+        results = [_semantic_cache_lookup(vector, n_results) for vector in query_vectors]
+        misses = [i for i, cached in enumerate(results) if cached is None]
+        if not misses:
+            if keyword_task is not None:
+                keyword_task.cancel()
+            return results
+        # Retrieve exactly n_candidates per branch without mutating the shared retrievers
+        rankings = await asyncio.to_thread(
+            _semantic_top_n, collection, positions, query_vectors[misses].tolist(), n_candidates
+        )
+        for i, ranking in zip(misses, rankings):
+            semantic_rankings[i] = ranking
+    keyword_rankings = await keyword_task if keyword_task is not None else [no_hits] * len(queries)
+
+    misses = [i for i, cached in enumerate(results) if cached is None]
+    ranked = await asyncio.to_thread(
+        lambda: [
+            _rank(queries[i], chunks, semantic_rankings[i], keyword_rankings[i], n_results)
+            for i in misses
+        ]
+    )
+    for i, search_results in zip(misses, ranked):
+        results[i] = search_results
+        if query_vectors is not None:
+            _semantic_cache.append(
+                (query_vectors[i], n_results, search_results, time.monotonic() + RESULT_CACHE_TTL)
+            )
+    return results
+
+
+class _QueryBatcher:
+    """
+    Coalesces concurrent vector_search calls on one event loop into _search_batch calls.
+
+    Queries arriving within MICRO_BATCH_WINDOW seconds of the first (up to
+    MICRO_BATCH_SIZE of them) share one embedding request and one ChromaDB query.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._dispatches: set = set()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def search(self, query: str, n_results: int) -> Tuple[ResultRow, ...]:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, n_results, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + MICRO_BATCH_WINDOW
+            while len(batch) < MICRO_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # A batch shares n_results, so split the window's queries by it
+            groups: Dict[int, List[Tuple[str, asyncio.Future]]] = {}
+            for query, n_results, future in batch:
+                groups.setdefault(n_results, []).append((query, future))
+            # Dispatch without waiting so the next window fills while this one searches
+            for n_results, items in groups.items():
+                task = loop.create_task(self._dispatch(items, n_results))
+                self._dispatches.add(task)
+                task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, items: List[Tuple[str, asyncio.Future]], n_results: int) -> None:
+        try:
+            results = await _search_batch([query for query, _ in items], n_results)
+        except Exception as exc:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, future), search_results in zip(items, results):
+            if not future.done():
+                future.set_result(search_results)
+
+
+# One batcher per event loop, since queues and futures are bound to the loop that made them.
+# A batcher's worker task references its loop, so the weak key alone never frees an
+# entry; each entry is dropped when its worker ends (asyncio.run cancels it on shutdown)
+_batchers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _QueryBatcher]" = weakref.WeakKeyDictionary()
+
+
+def _get_batcher() -> _QueryBatcher:
+    """Return the running event loop's batcher, starting it on first use."""
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        batcher = _batchers[loop] = _QueryBatcher()
+        batcher._worker.add_done_callback(lambda _: _batchers.pop(loop, None))
+    return batcher
+
+
+def _cache_get(query: str, n_results: int) -> Optional[Tuple[ResultRow, ...]]:
+    """Return unexpired cached results for the normalized query, if any."""
+    key = (query.lower().strip(), n_results)
+    entry = _result_cache.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        _result_cache.move_to_end(key)
+        return entry[1]
+    return None
+
+
+def _cache_put(query: str, n_results: int, results: Tuple[ResultRow, ...]) -> None:
+    """Cache results for the normalized query, evicting the least recently used entry."""
+    key = (query.lower().strip(), n_results)
+    _result_cache[key] = (time.monotonic() + RESULT_CACHE_TTL, results)
+    _result_cache.move_to_end(key)
+    if len(_result_cache) > RESULT_CACHE_SIZE:
+        _result_cache.popitem(last=False)
+
+
+async def vector_search(query: str, n_results: int = 10) -> List[Dict]:
+    """
+    Minimal search function for ChromaDB collection.
+    Args:
+        query (str): The search query.
+        n_results (int, optional): The number of results to return. Defaults to 10.
+    Returns:
+        List[Dict]: A list of search results, best first, each containing:
+            - content (str): The content of the chunk.
+            - source (str): The source file of the chunk.
+            - json_file (str): The JSON file associated with the chunk.
+            - score (float): The relevance score of the chunk (higher is more relevant).
+            - rank (int): The 1-based position of the chunk in the results.
+    """
+    results = _cache_get(query, n_results)
+    if results is None:
+        results = await _get_batcher().search(query, n_results)
+        _cache_put(query, n_results, results)
+    
+    return _to_dicts(results)
+
+
+async def vector_search_batch(queries: List[str], n_results: int = 10) -> List[List[Dict]]:
+    """
+    Search the ChromaDB collection for several queries at once.
+    Prefer this over repeated vector_search calls when you have multiple query formulations.
+    Args:
+        queries (List[str]): The search queries.
+        n_results (int, optional): The number of results to return per query. Defaults to 10.
+    Returns:
+        List[List[Dict]]: One result list per query, in the same order as queries,
+            each with the same fields as vector_search results.
+    """
+    results = {query: _cache_get(query, n_results) for query in queries}
+    pending = [query for query, cached in results.items() if cached is None]
+    if pending:
+        for query, fresh in zip(pending, await _search_batch(pending, n_results)):
+            _cache_put(query, n_results, fresh)
+            results[query] = fresh
+
+    return [_to_dicts(results[query]) for query in queries]
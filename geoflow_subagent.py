@@ -12,11 +12,17 @@ DESIGN PRINCIPLES:
 - Separation of configuration from code logic
 """
 
-from config.agent_config import AgentConfig
+from config.agent_config import get_agent_config
 
 # Load configuration instance
-config = AgentConfig()
+config = get_agent_config()
 
-# Export sub-agents list for backward compatibility
-# This maintains the same interface as the original hardcoded COMPLIANCE_SUBAGENTS
-COMPLIANCE_SUBAGENTS = config.get_subagents_for_main("geoflow")
\ No newline at end of file
+
+def __getattr__(name):
+    """Resolve the exported sub-agent lists on first access rather than at import."""
+    # Export sub-agents list for backward compatibility
+    # This maintains the same interface as the original hardcoded COMPLIANCE_SUBAGENTS
+    if name == "COMPLIANCE_SUBAGENTS":
+        value = globals()[name] = config.get_subagents_for_main("geoflow")
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,40 @@
+"""Expiry of the near-duplicate query cache in geoflow_retrieval."""
+
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import geoflow_retrieval
+
+
+class SemanticCacheExpiryTest(unittest.TestCase):
+    def setUp(self):
+        geoflow_retrieval._semantic_cache.clear()
+        self.addCleanup(geoflow_retrieval._semantic_cache.clear)
+        self.vector = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+        self.results = (("content", "source.pdf", "source.json", 1.0, 1),)
+
+    def _add(self, expires_at):
+        geoflow_retrieval._semantic_cache.append((self.vector, 3, self.results, expires_at))
+
+    def test_unexpired_entry_is_served(self):
+        with mock.patch.object(geoflow_retrieval.time, "monotonic", return_value=100.0):
+            self._add(expires_at=100.0 + geoflow_retrieval.RESULT_CACHE_TTL)
+            self.assertEqual(geoflow_retrieval._semantic_cache_lookup(self.vector, 3), self.results)
+
+    def test_expired_entry_is_skipped(self):
+        with mock.patch.object(geoflow_retrieval.time, "monotonic", return_value=100.0):
+            self._add(expires_at=99.0)
+            self.assertIsNone(geoflow_retrieval._semantic_cache_lookup(self.vector, 3))
+
+    def test_fresh_entry_wins_over_expired_duplicate(self):
+        fresh = (("fresh", "source.pdf", "source.json", 2.0, 1),)
+        with mock.patch.object(geoflow_retrieval.time, "monotonic", return_value=100.0):
+            self._add(expires_at=99.0)
+            geoflow_retrieval._semantic_cache.append((self.vector, 3, fresh, 200.0))
+            self.assertEqual(geoflow_retrieval._semantic_cache_lookup(self.vector, 3), fresh)
+
+
+if __name__ == "__main__":
+    unittest.main()